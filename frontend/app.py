@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import orjson
 import base64
 from PIL import Image
 import io
@@ -10,6 +11,56 @@ import os
 # --------------------------------------------------
 API_URL = "http://localhost:8000"
 
+# --------------------------------------------------
+# API REQUESTS (KEEP-ALIVE + ETAG REVALIDATION)
+# --------------------------------------------------
+@st.cache_resource
+def get_session():
+    """Shared HTTP session so the backend connection is reused across reruns."""
+    return requests.Session()
+
+
+def post_files(endpoint, files, data, error_message):
+    """
+    POST files to the API and return the parsed JSON response.
+
+    The last ETag and response per endpoint are kept in session state
+    and sent as If-None-Match, so a Streamlit rerun with unchanged
+    files gets a 304 from the backend and reuses the stored response.
+    """
+    etag_cache = st.session_state.setdefault("etag_cache", {})
+    headers = {}
+    if endpoint in etag_cache:
+        headers["If-None-Match"] = etag_cache[endpoint]["etag"]
+
+    response = get_session().post(
+        f"{API_URL}{endpoint}",
+        files=files,
+        data=data,
+        headers=headers,
+        timeout=300
+    )
+
+    if response.status_code == 304 and endpoint in etag_cache:
+        return etag_cache[endpoint]["data"]
+
+    if response.status_code != 200:
+        try:
+            st.error(orjson.loads(response.content).get("message", error_message))
+        except Exception:
+            st.error(error_message)
+        st.stop()
+
+    result = orjson.loads(response.content)
+
+    etag = response.headers.get("ETag")
+    if etag:
+        etag_cache[endpoint] = {"etag": etag, "data": result}
+    else:
+        etag_cache.pop(endpoint, None)
+
+    return result
+
 # --------------------------------------------------
 # PAGE CONFIG
 # --------------------------------------------------
@@ -105,70 +156,61 @@ if uploaded_files:
     ]
 
     # --------------------------------------------------
-    # ANALYZE DOCUMENTS
+    # ANALYZE DOCUMENTS + VISUAL CUES (SINGLE REQUEST)
     # --------------------------------------------------
-    with st.spinner("🔍 Analyzing documents..."):
-        response = requests.post(
-            f"{API_URL}/analyze",
-            files=files,
-            timeout=300
+    spinner_text = (
+        "🔍 Analyzing documents and extracting visual cues..."
+        if extract_visual else "🔍 Analyzing documents..."
+    )
+    with st.spinner(spinner_text):
+        response_data = post_files(
+            "/analyze_v2",
+            files,
+            {"extract_visual": "true" if extract_visual else "false"},
+            "Analyze API failed"
         )
 
-    if response.status_code != 200:
-        try:
-            st.error(response.json().get("message", "Analyze API failed"))
-        except Exception:
-            st.error("Analyze API failed")
-        st.stop()
-
-    analysis_data = response.json()
+    analysis_data = response_data["analysis"]
 
     # --------------------------------------------------
     # VISUAL CUES
     # --------------------------------------------------
     visual_map = {}
 
-    if extract_visual:
-        with st.spinner("🧿 Extracting visual cues..."):
-            visual_response = requests.post(
-                f"{API_URL}/visual_cues",
-                files=files,
-                timeout=300
-            )
-
-        if visual_response.status_code != 200:
-            try:
-                st.error(visual_response.json().get("message", "Visual cues API failed"))
-            except Exception:
-                st.error("Visual cues API failed")
-            st.stop()
-
-        visual_data = visual_response.json()
-        for item in visual_data:
-            visual_map[item["file"]] = item.get("visual_cues", [])
+    visual_data = response_data.get("visual_cues")
+    if extract_visual and visual_data:
+        # Columnar response: one entry per file in each list
+        for filename, cues in zip(visual_data["files"], visual_data["visual_cues"]):
+            visual_map[filename] = cues or []
 
     # --------------------------------------------------
     # RENDER RESULTS
     # --------------------------------------------------
-    for item in analysis_data:
-        filename = item.get("file", "Unknown File")
+    for filename, document_type, reasoning, fields, error in zip(
+        analysis_data["files"],
+        analysis_data["document_types"],
+        analysis_data["reasonings"],
+        analysis_data["extracted_textfields"],
+        analysis_data["errors"],
+    ):
+        filename = filename or "Unknown File"
 
         st.markdown(
             f"<div class='file-header'>📄 {filename}</div>",
             unsafe_allow_html=True
         )
 
-        if "error" in item:
-            st.error(item["error"])
+        if error:
+            st.error(error)
             continue
 
         st.markdown(
-            f"<div class='section-gap'><strong>📌 Document Type:</strong> {item.get('document_type')}</div>",
+            f"<div class='section-gap'><strong>📌 Document Type:</strong> {document_type}</div>",
             unsafe_allow_html=True
         )
 
         st.markdown(
-            f"<div class='section-gap'><strong>Reasoning:</strong><br>{item.get('reasoning')}</div>",
+            f"<div class='section-gap'><strong>Reasoning:</strong><br>{reasoning}</div>",
             unsafe_allow_html=True
         )
 
@@ -177,7 +219,6 @@ if uploaded_files:
             unsafe_allow_html=True
         )
 
-        fields = item.get("extracted_textfields", {})
         if not fields:
             st.info("No text fields extracted")
         else:
@@ -4,13 +4,22 @@ MAX_CONCURRENT_OCR: int = 5
 # Vision LLM model name (OpenRouter)
 VISION_MODEL_NAME: str = "nvidia/nemotron-nano-12b-v2-vl:free"
 
+# Maximum pooled HTTP connections to the Vision LLM endpoint
+VISION_MAX_CONNECTIONS: int = 20
+
+# Maximum image size sent to the Vision LLM (downscaled before encoding)
+VISION_IMAGE_MAX_SIZE = (1024, 1024)
+VISION_JPEG_QUALITY: int = 90
+
 
 # Logo detection model
 LOGO_DETECTION_MODEL: str = "ellabettison/Logo-Detection-finetune"
+LOGO_DETECTION_THRESHOLD: float = 0.5
+LOGO_DETECTION_QUANTIZE: bool = True
 
 
 # PDF to image conversion settings
-PDF_IMAGE_DPI: int = 302
+PDF_IMAGE_DPI: int = 150
 PDF_IMAGE_BASE_DIR: str = "uploads/images"
 
 
@@ -27,6 +36,12 @@ MAX_IMAGES: int = 5
 MAX_IMAGE_MB: int = 5
 MAX_PDF_MB: int = 10
 
+# -------------------------------
+# RESULT CACHE (shared across workers)
+# -------------------------------
+CACHE_DIR: str = "/tmp/docvision_cache"
+CACHE_SIZE_LIMIT: int = 2**30  # bytes per cache
+
 # -------------------------------
 # IMAGE VALIDATION
 # -------------------------------
@@ -41,4 +56,5 @@ MAX_HEIGHT: int = 6000
 MAX_VISUAL_PAGES: int = 1
 MAX_LOGOS_PER_PAGE: int = 4
 MAX_IMAGE_RESIZE = (1024, 1024)
+LOGO_JPEG_QUALITY: int = 85
 
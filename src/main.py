@@ -1,20 +1,26 @@
 
 import os
 import io
-import hashlib
 import asyncio
-from typing import List, Dict, Any
+import contextlib
+import tempfile
+from typing import List, Dict, Any, Optional, Tuple
 
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Form, Request, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from PIL import Image
+from diskcache import Cache
+import orjson
+import xxhash
 
-from src.pdfconverter import pdf_to_images
-from src.vision import classify_image
-from src.visual_cues import detect_logos_from_bytes
+from src.pdfconverter import render_pdf_pages
+from src.vision import classify_image_from_bytes
+from src.visual_cues import prepare_image, detect_prepared_logos
 from src.config import (
     UPLOAD_DIR,
+    CACHE_DIR,
+    CACHE_SIZE_LIMIT,
     ALLOWED_EXTENSIONS,
     MAX_TOTAL_FILES,
     MAX_PDFS,
@@ -34,7 +40,9 @@ from src.config import (
 # --------------------------------------------------
 # FASTAPI APPLICATION
 # --------------------------------------------------
-app = FastAPI(title="DocVision API")
+# Endpoints return ORJSONResponse objects directly (response_model=None),
+# so results are serialized once by orjson without jsonable_encoder
+app = FastAPI(title="DocVision API", default_response_class=ORJSONResponse)
 
 
 # --------------------------------------------------
@@ -52,10 +60,10 @@ app.add_middleware(
 # --------------------------------------------------
 # HEALTH CHECK
 # --------------------------------------------------
-@app.get("/")
-def health() -> Dict[str, str]:
+@app.get("/", response_model=None)
+def health() -> ORJSONResponse:
     """Health check endpoint for routing and monitoring."""
-    return {"status": "ok"}
+    return ORJSONResponse({"status": "ok"})
 
 
 # --------------------------------------------------
@@ -65,18 +73,117 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
 # --------------------------------------------------
-# IN-MEMORY CACHES
+# ON-DISK CACHES (LRU, SHARED ACROSS WORKERS)
 # --------------------------------------------------
-TEXT_CACHE: Dict[str, Dict[str, Any]] = {}
-VISUAL_CACHE: Dict[str, Dict[str, Any]] = {}
+TEXT_CACHE: Cache = Cache(
+    os.path.join(CACHE_DIR, "text"),
+    size_limit=CACHE_SIZE_LIMIT,
+    eviction_policy="least-recently-used",
+)
+VISUAL_CACHE: Cache = Cache(
+    os.path.join(CACHE_DIR, "visual"),
+    size_limit=CACHE_SIZE_LIMIT,
+    eviction_policy="least-recently-used",
+)
+
+
+# --------------------------------------------------
+# IN-FLIGHT REQUEST DEDUPLICATION
+# --------------------------------------------------
+# Analyses in progress keyed by file id, so concurrent identical
+# uploads share one OCR + LLM run
+TEXT_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+
+# --------------------------------------------------
+# RESPONSE COLUMNS (column name -> per-file result key)
+# --------------------------------------------------
+ANALYSIS_COLUMNS: Dict[str, str] = {
+    "files": "file",
+    "document_types": "document_type",
+    "reasonings": "reasoning",
+    "extracted_textfields": "extracted_textfields",
+    "errors": "error",
+}
+VISUAL_COLUMNS: Dict[str, str] = {
+    "files": "file",
+    "visual_cues": "visual_cues",
+    "errors": "error",
+}
 
 
 # --------------------------------------------------
 # HELPER FUNCTIONS
 # --------------------------------------------------
 def file_hash(data: bytes) -> str:
-    """Generate a deterministic hash for file contents."""
-    return hashlib.md5(data).hexdigest()
+    """Generate a deterministic (non-cryptographic) hash for file contents."""
+    return xxhash.xxh3_128(data).hexdigest()
+
+
+async def cache_get(cache: Cache, key: str) -> Optional[Dict[str, Any]]:
+    """Return a cached result, or None on a cache miss (off the event loop)."""
+    data = await asyncio.to_thread(cache.get, key)
+    return orjson.loads(data) if data is not None else None
+
+
+async def cache_set(cache: Cache, key: str, value: Dict[str, Any]) -> None:
+    """Store a result in the cache as JSON bytes (off the event loop)."""
+    await asyncio.to_thread(cache.set, key, orjson.dumps(value))
+
+
+def to_columns(
+    results: List[Dict[str, Any]],
+    fields: Dict[str, str]
+) -> Dict[str, List[Any]]:
+    """
+    Convert per-file result rows into a columnar (struct-of-arrays) payload.
+
+    ``fields`` maps each output column name to the row key it is built
+    from. Every column has one entry per file; missing keys become None.
+    """
+    return {
+        column: [row.get(key) for row in results]
+        for column, key in fields.items()
+    }
+
+
+def compute_etag(scope: str, fids: List[str]) -> str:
+    """Build a quoted ETag from an endpoint name and its ordered file ids."""
+    digest = xxhash.xxh3_128("|".join([scope, *fids]).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def with_etag(
+    response: Response,
+    etag: str,
+    results: List[Dict[str, Any]]
+) -> Response:
+    """
+    Attach the ETag to a response when every file succeeded.
+
+    Responses containing errors or non-cacheable fallback analyses are
+    not tagged, so clients retry them instead of revalidating them.
+    """
+    if not any(
+        "error" in result or result.get("cacheable") is False
+        for result in results
+    ):
+        response.headers["ETag"] = etag
+    return response
+
+
+def fid_digest(fid: str) -> str:
+    """Return the content hash part of a file id built by :func:`read_uploads`."""
+    return fid.rsplit("_", 1)[1]
+
+
+async def read_uploads(files: List[UploadFile]) -> Tuple[List[bytes], List[str]]:
+    """Read all uploads off the event loop and derive their file ids."""
+    contents = await asyncio.gather(
+        *[asyncio.to_thread(read_file, f) for f in files]
+    )
+    fids = [f"{f.filename}_{file_hash(c)}" for f, c in zip(files, contents)]
+    return list(contents), fids
 
 
 def read_file(file: UploadFile) -> bytes:
@@ -86,23 +193,28 @@ def read_file(file: UploadFile) -> bytes:
     return data
 
 
-def validate_file(file: UploadFile, contents: bytes) -> str | None:
+def validate_file(
+    file: UploadFile,
+    contents: bytes
+) -> Tuple[Optional[str], Optional[Image.Image]]:
     """
     Validate file type, size, and image resolution.
 
-    Returns an error message if invalid, otherwise None.
+    Returns a tuple of (error message, opened image). The error is
+    None when the file is valid; the image is only returned for
+    valid image uploads so it can be reused without decoding again.
     """
     ext = os.path.splitext(file.filename)[1].lower()
     size_mb = len(contents) / (1024 * 1024)
 
     if ext not in ALLOWED_EXTENSIONS:
-        return "Unsupported file format"
+        return "Unsupported file format", None
 
     if ext == ".pdf" and size_mb > MAX_PDF_MB:
-        return f"PDF exceeds {MAX_PDF_MB} MB"
+        return f"PDF exceeds {MAX_PDF_MB} MB", None
 
     if ext != ".pdf" and size_mb > MAX_IMAGE_MB:
-        return f"Image exceeds {MAX_IMAGE_MB} MB"
+        return f"Image exceeds {MAX_IMAGE_MB} MB", None
 
     if ext != ".pdf":
         try:
@@ -110,63 +222,112 @@ def validate_file(file: UploadFile, contents: bytes) -> str | None:
             width, height = image.size
 
             if width < MIN_WIDTH or height < MIN_HEIGHT:
-                return f"Image too small ({width}x{height})"
+                return f"Image too small ({width}x{height})", None
 
             if width > MAX_WIDTH or height > MAX_HEIGHT:
-                return f"Image too large ({width}x{height})"
+                return f"Image too large ({width}x{height})", None
+
+            return None, image
 
         except Exception:
-            return "Invalid image file"
+            return "Invalid image file", None
 
-    return None
+    return None, None
 
 
-# --------------------------------------------------
-# DOCUMENT ANALYSIS ENDPOINT
-# --------------------------------------------------
-@app.post("/analyze")
-async def analyze(files: List[UploadFile] = File(...)) -> JSONResponse:
+def validate_and_save(
+    file: UploadFile,
+    contents: bytes,
+    digest: str
+) -> Tuple[Optional[str], Optional[Image.Image], Optional[str]]:
     """
-    Perform OCR + Vision-based document classification.
+    Validate a file and, if it is a valid PDF, write it to the upload
+    directory. Images are processed from memory and are not saved.
+
+    PDFs are stored under their content hash (``digest``, as computed
+    by :func:`read_uploads`) rather than the uploaded filename, so
+    different files never share a path on disk and client filenames
+    never choose where files are written.
+
+    Runs as a single blocking unit so it can be offloaded to a
+    worker thread. Returns (error message, opened image, saved path);
+    the path is None unless a PDF was saved.
     """
-    if len(files) > MAX_TOTAL_FILES:
-        return JSONResponse(
-            {"error": f"Maximum {MAX_TOTAL_FILES} files allowed"},
-            status_code=400,
-        )
+    error, image = validate_file(file, contents)
 
-    pdf_count = sum(f.filename.lower().endswith(".pdf") for f in files)
-    img_count = len(files) - pdf_count
+    if error is not None or not file.filename.lower().endswith(".pdf"):
+        return error, image, None
 
-    async def process_file(file: UploadFile) -> Dict[str, Any]:
-        contents = read_file(file)
-        fid = f"{file.filename}_{file_hash(contents)}"
+    path = os.path.join(UPLOAD_DIR, f"{digest}.pdf")
 
-        if file.filename.lower().endswith(".pdf") and pdf_count > MAX_PDFS:
-            return {"file": file.filename, "error": f"Maximum {MAX_PDFS} PDFs allowed"}
+    # Write to a temporary file and rename, so concurrent requests
+    # saving the same content never read a partially written file
+    temp_file = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, delete=False)
+    try:
+        with temp_file:
+            temp_file.write(contents)
+        os.replace(temp_file.name, path)
 
-        if not file.filename.lower().endswith(".pdf") and img_count > MAX_IMAGES:
-            return {"file": file.filename, "error": f"Maximum {MAX_IMAGES} images allowed"}
+    except BaseException:
+        # Do not leave a partial temporary file behind in the upload directory
+        with contextlib.suppress(OSError):
+            os.remove(temp_file.name)
+        raise
 
-        if fid in TEXT_CACHE:
-            return TEXT_CACHE[fid]
+    return None, image, path
 
-        error = validate_file(file, contents)
-        if error:
-            return {"file": file.filename, "error": error}
 
-        path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(path, "wb") as f:
-            f.write(contents)
+def render_first_page(pdf_path: str) -> Tuple[bytes, Image.Image]:
+    """
+    Render the first PDF page in memory.
+
+    Returns the page as PNG bytes (for OCR) together with the decoded
+    image (for the Vision LLM), without writing anything to disk.
+    """
+    page_image = render_pdf_pages(pdf_path, 1)[0]
+
+    buffer = io.BytesIO()
+    page_image.save(buffer, format="PNG")
+
+    return buffer.getvalue(), page_image
+
 
+# --------------------------------------------------
+# DOCUMENT ANALYSIS
+# --------------------------------------------------
+async def run_analysis_batch(
+    files: List[UploadFile],
+    contents_list: List[bytes],
+    fids: List[str]
+) -> List[Dict[str, Any]]:
+    """Run OCR + Vision classification for every upload, one result per file."""
+    pdf_count = sum(f.filename.lower().endswith(".pdf") for f in files)
+    img_count = len(files) - pdf_count
+
+    async def run_analysis(
+        file: UploadFile,
+        contents: bytes,
+        fid: str
+    ) -> Dict[str, Any]:
         try:
+            error, image, path = await asyncio.to_thread(
+                validate_and_save, file, contents, fid_digest(fid)
+            )
+            if error:
+                return {"file": file.filename, "error": error}
+
             if file.filename.lower().endswith(".pdf"):
-                pdf_name = await asyncio.to_thread(pdf_to_images, path)
-                base_dir = os.path.join("uploads", "images", pdf_name)
-                first_page = sorted(os.listdir(base_dir))[0]
-                analysis = await classify_image(os.path.join(base_dir, first_page))
+                page_bytes, page_image = await asyncio.to_thread(
+                    render_first_page, path
+                )
+                page_name = f"{os.path.splitext(file.filename)[0]}_page_1.png"
+                analysis = await classify_image_from_bytes(
+                    page_bytes, page_name, page_image
+                )
             else:
-                analysis = await classify_image(path)
+                analysis = await classify_image_from_bytes(
+                    contents, file.filename, image
+                )
 
             result = {
                 "file": file.filename,
@@ -175,71 +336,296 @@ async def analyze(files: List[UploadFile] = File(...)) -> JSONResponse:
                 "extracted_textfields": analysis.get("extracted_textfields", {}),
             }
 
-            TEXT_CACHE[fid] = result
+            if analysis.get("cacheable", False):
+                await cache_set(TEXT_CACHE, fid, result)
+            else:
+                # Internal marker (not a response column) so the response
+                # is not given an ETag either
+                result["cacheable"] = False
             return result
 
         except Exception as exc:
             return {"file": file.filename, "error": f"Processing failed: {exc}"}
 
-    results = await asyncio.gather(*[process_file(f) for f in files])
-    return JSONResponse(content=results)
+    async def process_file(
+        file: UploadFile,
+        contents: bytes,
+        fid: str
+    ) -> Dict[str, Any]:
+        if file.filename.lower().endswith(".pdf") and pdf_count > MAX_PDFS:
+            return {"file": file.filename, "error": f"Maximum {MAX_PDFS} PDFs allowed"}
 
+        if not file.filename.lower().endswith(".pdf") and img_count > MAX_IMAGES:
+            return {"file": file.filename, "error": f"Maximum {MAX_IMAGES} images allowed"}
 
-# --------------------------------------------------
-# VISUAL CUES ENDPOINT
-# --------------------------------------------------
-@app.post("/visual_cues")
-async def visual_cues(files: List[UploadFile] = File(...)) -> JSONResponse:
-    """
-    Detect logos, seals, and visual symbols from documents.
-    """
+        cached = await cache_get(TEXT_CACHE, fid)
+        if cached is not None:
+            return cached
+
+        # Single-flight: wait for an identical upload already being processed
+        while (inflight := TEXT_INFLIGHT.get(fid)) is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Only propagate our own cancellation; if the owning
+                # request was cancelled, run the analysis ourselves
+                if not inflight.cancelled():
+                    raise
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Mark the exception as retrieved when nobody is waiting
+        future.add_done_callback(
+            lambda done: done.cancelled() or done.exception()
+        )
+        TEXT_INFLIGHT[fid] = future
 
-    async def process_visual(file: UploadFile) -> Dict[str, Any]:
-        contents = read_file(file)
-        fid = f"{file.filename}_{file_hash(contents)}"
+        try:
+            result = await run_analysis(file, contents, fid)
 
-        if fid in VISUAL_CACHE:
-            return VISUAL_CACHE[fid]
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
 
-        error = validate_file(file, contents)
-        if error:
-            return {"file": file.filename, "error": error}
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+
+        else:
+            future.set_result(result)
+            return result
 
-        path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(path, "wb") as f:
-            f.write(contents)
+        finally:
+            TEXT_INFLIGHT.pop(fid, None)
 
-        visuals = []
+    results = await asyncio.gather(
+        *[process_file(f, c, fid) for f, c, fid in zip(files, contents_list, fids)]
+    )
+    return list(results)
+
+
+# --------------------------------------------------
+# VISUAL CUE DETECTION
+# --------------------------------------------------
+async def run_visual_batch(
+    files: List[UploadFile],
+    contents_list: List[bytes],
+    fids: List[str]
+) -> List[Dict[str, Any]]:
+    """Detect logos for every upload in one batched pass, one result per file."""
+    async def load_visual(
+        file: UploadFile,
+        contents: bytes,
+        fid: str
+    ) -> Dict[str, Any]:
+        """
+        Validate a file and load the page images to run detection on.
+
+        Returns either a final "result" (cache hit or error) or the
+        "pages" (label, image) pending batched detection.
+        """
+        cached = await cache_get(VISUAL_CACHE, fid)
+        if cached is not None:
+            return {"result": cached}
+
+        error, image, path = await asyncio.to_thread(
+            validate_and_save, file, contents, fid_digest(fid)
+        )
+        if error:
+            return {"result": {"file": file.filename, "error": error}}
 
         try:
             if file.filename.lower().endswith(".pdf"):
-                pdf_name = await asyncio.to_thread(pdf_to_images, path)
-                base_dir = os.path.join("uploads", "images", pdf_name)
-
-                for img_name in sorted(os.listdir(base_dir))[:MAX_VISUAL_PAGES]:
-                    with open(os.path.join(base_dir, img_name), "rb") as img_file:
-                        logos = await asyncio.to_thread(
-                            detect_logos_from_bytes,
-                            img_file.read(),
-                            MAX_IMAGE_RESIZE,
-                            MAX_LOGOS_PER_PAGE,
-                        )
-                    visuals.append({"page": img_name, "logos": logos})
+                page_images = await asyncio.to_thread(
+                    render_pdf_pages, path, MAX_VISUAL_PAGES
+                )
+                labels = [
+                    f"page_{page_index}.png"
+                    for page_index in range(1, len(page_images) + 1)
+                ]
             else:
-                logos = await asyncio.to_thread(
-                    detect_logos_from_bytes,
-                    contents,
-                    MAX_IMAGE_RESIZE,
+                page_images = [image]
+                labels = ["image"]
+
+            # Decode + resize per file, so a corrupt upload only fails itself
+            prepared = []
+            for page_image in page_images:
+                prepared.append(
+                    await asyncio.to_thread(prepare_image, page_image, MAX_IMAGE_RESIZE)
+                )
+            pages = list(zip(labels, prepared))
+
+        except Exception as exc:
+            return {"result": {"file": file.filename, "error": f"Visual processing failed: {exc}"}}
+
+        return {"file": file.filename, "fid": fid, "pages": pages}
+
+    loaded = await asyncio.gather(
+        *[load_visual(f, c, fid) for f, c, fid in zip(files, contents_list, fids)]
+    )
+
+    pending = [item for item in loaded if "pages" in item]
+
+    # Run detection once for all pages of all files
+    page_images = [page for item in pending for _, page in item["pages"]]
+    page_logos: List[Any] = []
+    batch_failed = False
+
+    if page_images:
+        try:
+            page_logos = await asyncio.to_thread(
+                detect_prepared_logos, page_images, MAX_LOGOS_PER_PAGE
+            )
+        except Exception:
+            batch_failed = True
+
+    if batch_failed:
+        # The batch failed; detect per file so errors stay per file
+        for item in pending:
+            try:
+                item["logos"] = await asyncio.to_thread(
+                    detect_prepared_logos,
+                    [page for _, page in item["pages"]],
                     MAX_LOGOS_PER_PAGE,
                 )
-                visuals.append({"page": "image", "logos": logos})
+            except Exception as exc:
+                item["error"] = f"Visual processing failed: {exc}"
+    else:
+        page_index = 0
+        for item in pending:
+            item["logos"] = page_logos[page_index:page_index + len(item["pages"])]
+            page_index += len(item["pages"])
 
-            result = {"file": file.filename, "visual_cues": visuals}
-            VISUAL_CACHE[fid] = result
-            return result
+    results = []
 
-        except Exception as exc:
-            return {"file": file.filename, "error": f"Visual processing failed: {exc}"}
+    for item in loaded:
+        if "result" in item:
+            results.append(item["result"])
+            continue
+
+        if "error" in item:
+            results.append({"file": item["file"], "error": item["error"]})
+            continue
+
+        visuals = [
+            {"page": page_label, "logos": logos}
+            for (page_label, _), logos in zip(item["pages"], item["logos"])
+        ]
+
+        result = {"file": item["file"], "visual_cues": visuals}
+        await cache_set(VISUAL_CACHE, item["fid"], result)
+        results.append(result)
+
+    return results
+
+
+# --------------------------------------------------
+# DOCUMENT ANALYSIS ENDPOINT
+# --------------------------------------------------
+@app.post("/analyze", response_model=None)
+async def analyze(
+    request: Request,
+    files: List[UploadFile] = File(...)
+) -> Response:
+    """
+    Perform OCR + Vision-based document classification.
+
+    Returns 304 Not Modified when If-None-Match matches the ETag
+    of the uploaded files.
+    """
+    if len(files) > MAX_TOTAL_FILES:
+        return ORJSONResponse(
+            {"error": f"Maximum {MAX_TOTAL_FILES} files allowed"},
+            status_code=400,
+        )
+
+    contents_list, fids = await read_uploads(files)
+    etag = compute_etag("analyze", fids)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    results = await run_analysis_batch(files, contents_list, fids)
+    return with_etag(
+        ORJSONResponse(content=to_columns(results, ANALYSIS_COLUMNS)),
+        etag,
+        results,
+    )
 
-    results = await asyncio.gather(*[process_visual(f) for f in files])
-    return JSONResponse(content=results)
+
+# --------------------------------------------------
+# VISUAL CUES ENDPOINT
+# --------------------------------------------------
+@app.post("/visual_cues", response_model=None)
+async def visual_cues(
+    request: Request,
+    files: List[UploadFile] = File(...)
+) -> Response:
+    """
+    Detect logos, seals, and visual symbols from documents.
+
+    Returns 304 Not Modified when If-None-Match matches the ETag
+    of the uploaded files.
+    """
+    contents_list, fids = await read_uploads(files)
+    etag = compute_etag("visual_cues", fids)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    results = await run_visual_batch(files, contents_list, fids)
+    return with_etag(
+        ORJSONResponse(content=to_columns(results, VISUAL_COLUMNS)),
+        etag,
+        results,
+    )
+
+
+# --------------------------------------------------
+# COMBINED ANALYSIS + VISUAL CUES ENDPOINT
+# --------------------------------------------------
+@app.post("/analyze_v2", response_model=None)
+async def analyze_v2(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    extract_visual: bool = Form(False)
+) -> Response:
+    """
+    Perform document classification and, optionally, visual cue
+    detection in a single request.
+
+    Both pipelines run concurrently on the same uploaded bytes. The
+    response contains "analysis" and "visual_cues" (null unless
+    ``extract_visual`` is set), each in the columnar layout of the
+    individual endpoints.
+    """
+    if len(files) > MAX_TOTAL_FILES:
+        return ORJSONResponse(
+            {"error": f"Maximum {MAX_TOTAL_FILES} files allowed"},
+            status_code=400,
+        )
+
+    contents_list, fids = await read_uploads(files)
+    etag = compute_etag(f"analyze_v2:{extract_visual}", fids)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if extract_visual:
+        analysis_results, visual_results = await asyncio.gather(
+            run_analysis_batch(files, contents_list, fids),
+            run_visual_batch(files, contents_list, fids),
+        )
+    else:
+        analysis_results = await run_analysis_batch(files, contents_list, fids)
+        visual_results = None
+
+    payload = {
+        "analysis": to_columns(analysis_results, ANALYSIS_COLUMNS),
+        "visual_cues": (
+            to_columns(visual_results, VISUAL_COLUMNS)
+            if visual_results is not None else None
+        ),
+    }
+
+    return with_etag(
+        ORJSONResponse(content=payload),
+        etag,
+        analysis_results + (visual_results or []),
+    )
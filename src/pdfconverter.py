@@ -1,9 +1,10 @@
 
 
 import os
-from typing import Optional
+from typing import List, Optional
 
 import fitz  # PyMuPDF
+from PIL import Image
 
 from src.config import PDF_IMAGE_DPI, PDF_IMAGE_BASE_DIR
 
@@ -13,8 +14,9 @@ from src.config import PDF_IMAGE_DPI, PDF_IMAGE_BASE_DIR
 # --------------------------------------------------
 def pdf_to_images(
     pdf_path: str,
-    base_dir: Optional[str] = None
-) -> str:
+    base_dir: Optional[str] = None,
+    max_pages: Optional[int] = None
+) -> List[str]:
     """
     Convert a multi-page PDF into individual PNG images.
 
@@ -29,12 +31,15 @@ def pdf_to_images(
     base_dir : str, optional
         Base directory where page images will be stored.
         Defaults to the configured PDF_IMAGE_BASE_DIR.
+    max_pages : int, optional
+        Maximum number of leading pages to render.
+        Defaults to all pages.
 
     Returns
     -------
-    str
-        Name of the PDF file (without extension), used
-        as the output folder name.
+    list[str]
+        Paths of the rendered page images, in page order.
+        They are stored in a folder named after the PDF.
     """
 
     # Resolve base output directory
@@ -50,14 +55,60 @@ def pdf_to_images(
     # Open PDF document
     document = fitz.open(pdf_path)
 
-    # Render each page as a high-resolution PNG image
+    page_paths: List[str] = []
+
+    # Render each requested page as a PNG image
     for page_index, page in enumerate(document, start=1):
+        if max_pages is not None and page_index > max_pages:
+            break
+
+        page_path = os.path.join(output_dir, f"page_{page_index}.png")
         pixmap = page.get_pixmap(dpi=PDF_IMAGE_DPI)
-        pixmap.save(
-            os.path.join(output_dir, f"page_{page_index}.png")
-        )
+        pixmap.save(page_path)
+        page_paths.append(page_path)
 
     # Close document to release resources
     document.close()
 
-    return pdf_name
+    return page_paths
+
+
+def render_pdf_pages(
+    pdf_path: str,
+    max_pages: Optional[int] = None,
+    dpi: int = PDF_IMAGE_DPI
+) -> List[Image.Image]:
+    """
+    Render the leading pages of a PDF directly into memory.
+
+    Unlike :func:`pdf_to_images`, nothing is written to disk.
+
+    Parameters
+    ----------
+    pdf_path : str
+        Path to the input PDF file.
+    max_pages : int, optional
+        Maximum number of leading pages to render.
+        Defaults to all pages.
+    dpi : int, optional
+        Rendering resolution.
+
+    Returns
+    -------
+    list[PIL.Image.Image]
+        Rendered RGB page images.
+    """
+    images: List[Image.Image] = []
+
+    with fitz.open(pdf_path) as document:
+        page_count = len(document)
+        if max_pages is not None:
+            page_count = min(page_count, max_pages)
+
+        for page_index in range(page_count):
+            pixmap = document.load_page(page_index).get_pixmap(dpi=dpi)
+            images.append(
+                Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+            )
+
+    return images
@@ -75,3 +75,37 @@ async def extract_text_from_image_async(file_path: str) -> str:
         except Exception as exc:
             print(f"OCR failed for {file_path}: {exc}")
             return ""
+
+
+async def extract_text_from_bytes_async(data: bytes, file_name: str) -> str:
+    """
+    Extract text asynchronously from in-memory image or PDF bytes.
+
+    The bytes are sent to LlamaParse directly, without a temporary
+    file. Shares the OCR concurrency limit with
+    :func:`extract_text_from_image_async`.
+
+    Parameters
+    ----------
+    data : bytes
+        Raw file contents.
+    file_name : str
+        Original file name; its extension tells LlamaParse the file type.
+
+    Returns
+    -------
+    str
+        Extracted text content, or an empty string on failure.
+    """
+    async with ocr_semaphore:
+        try:
+            documents = await parser.aload_data(
+                data,
+                extra_info={"file_name": file_name}
+            )
+
+            return "\n".join(doc.text for doc in documents).strip()
+
+        except Exception as exc:
+            print(f"OCR failed for {file_name}: {exc}")
+            return ""
@@ -1,16 +1,27 @@
 
 
 import os
-import base64
-import json
-import re
-from typing import Dict, Any
+import io
+import asyncio
+from typing import Dict, Any, Optional, Tuple
 
+import httpx
+import orjson
+import pybase64
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from PIL import Image
 
-from src.textextraction import extract_text_from_image_async
-from src.config import VISION_MODEL_NAME
+from src.textextraction import (
+    extract_text_from_image_async,
+    extract_text_from_bytes_async,
+)
+from src.config import (
+    VISION_MODEL_NAME,
+    VISION_IMAGE_MAX_SIZE,
+    VISION_JPEG_QUALITY,
+    VISION_MAX_CONNECTIONS,
+)
 
 # --------------------------------------------------
 # ENVIRONMENT SETUP
@@ -22,9 +33,18 @@ load_dotenv()
 # --------------------------------------------------
 # OPENROUTER CLIENT INITIALIZATION
 # --------------------------------------------------
-client: OpenAI = OpenAI(
+# Async client with a pooled keep-alive HTTP/2 connection, so concurrent
+# requests reuse TLS sessions instead of opening a connection per call
+client: AsyncOpenAI = AsyncOpenAI(
     base_url="https://openrouter.ai/api/v1",
-    api_key=os.getenv("OPENAI_API_KEY")
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=VISION_MAX_CONNECTIONS,
+            max_keepalive_connections=VISION_MAX_CONNECTIONS,
+        ),
+    ),
 )
 
 
@@ -73,22 +93,129 @@ Do not include markdown or code blocks.
 # --------------------------------------------------
 # HELPER FUNCTIONS
 # --------------------------------------------------
-def image_to_base64(path: str) -> str:
+# Source formats that can be sent to the Vision LLM unchanged
+SOURCE_MIME_TYPES: Dict[str, str] = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+
+def image_to_data_url(
+    image: Image.Image,
+    source_bytes: Optional[bytes] = None,
+    max_size: Tuple[int, int] = VISION_IMAGE_MAX_SIZE
+) -> str:
     """
-    Convert an image file to a base64-encoded string.
+    Convert an image to a base64 data URL for the Vision LLM.
+
+    When ``source_bytes`` are given and the image already fits within
+    ``max_size``, the original JPEG/PNG bytes are sent unchanged.
+    Otherwise the image is downscaled in place and re-encoded as JPEG,
+    or as PNG when it has transparency.
 
     Parameters
     ----------
-    path : str
-        Path to the image file.
+    image : PIL.Image.Image
+        Image to encode.
+    source_bytes : bytes, optional
+        Original encoded bytes of ``image``.
+    max_size : tuple[int, int], optional
+        Maximum image size sent to the model.
 
     Returns
     -------
     str
-        Base64-encoded image content.
+        ``data:<mime>;base64,...`` URL of the image.
+    """
+    width, height = image.size
+    mime_type = SOURCE_MIME_TYPES.get(image.format)
+
+    if (
+        source_bytes is not None
+        and mime_type is not None
+        and width <= max_size[0]
+        and height <= max_size[1]
+    ):
+        return f"data:{mime_type};base64,{pybase64.b64encode_as_string(source_bytes)}"
+
+    has_alpha = image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    )
+    image.thumbnail(max_size)
+
+    buffer = io.BytesIO()
+    if has_alpha:
+        image.save(buffer, format="PNG")
+        mime_type = "image/png"
+    else:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=VISION_JPEG_QUALITY)
+        mime_type = "image/jpeg"
+
+    return f"data:{mime_type};base64,{pybase64.b64encode_as_string(buffer.getbuffer())}"
+
+
+def image_path_to_data_url(
+    path: str,
+    max_size: Tuple[int, int] = VISION_IMAGE_MAX_SIZE
+) -> str:
+    """
+    Read an image file and convert it to a base64 data URL.
+
+    See :func:`image_to_data_url` for details.
     """
     with open(path, "rb") as file:
-        return base64.b64encode(file.read()).decode()
+        data = file.read()
+
+    with Image.open(io.BytesIO(data)) as image:
+        return image_to_data_url(image, data, max_size)
+
+
+def find_json_object(text: str) -> Optional[str]:
+    """
+    Return the first balanced top-level JSON object in ``text``.
+
+    Scans the text once, tracking brace depth and skipping braces
+    inside JSON strings, so malformed model output cannot trigger
+    regex backtracking.
+
+    Parameters
+    ----------
+    text : str
+        Raw model output.
+
+    Returns
+    -------
+    str or None
+        The JSON object substring, or None if no balanced object exists.
+    """
+    depth = 0
+    start = -1
+    in_string = False
+    escaped = False
+
+    for index, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            if depth:
+                in_string = True
+        elif char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+
+    return None
 
 
 def extract_json_from_text(text: str) -> Dict[str, Any]:
@@ -114,46 +241,37 @@ def extract_json_from_text(text: str) -> Dict[str, Any]:
         If valid JSON cannot be extracted.
     """
     try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        match = re.search(r"\{[\s\S]*\}", text)
-        if match:
-            return json.loads(match.group())
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        candidate = find_json_object(text)
+        if candidate:
+            return orjson.loads(candidate)
         raise ValueError("LLM did not return valid JSON")
 
 
 # --------------------------------------------------
-# ASYNC DOCUMENT CLASSIFICATION
+# VISION LLM REQUEST
 # --------------------------------------------------
-async def classify_image(image_path: str) -> Dict[str, Any]:
+async def query_vision_model(ocr_text: str, image_url: str) -> Dict[str, Any]:
     """
-    Perform document classification using OCR + Vision LLM.
-
-    Steps:
-    1. Extract text using OCR
-    2. Encode image as base64
-    3. Send text + image to Vision LLM
-    4. Parse and normalize JSON output
+    Send OCR text + image to the Vision LLM and normalize its output.
 
     Parameters
     ----------
-    image_path : str
-        Path to the image or PDF page.
+    ocr_text : str
+        Text extracted from the document by OCR.
+    image_url : str
+        Base64 data URL of the document image.
 
     Returns
     -------
     dict
         Structured classification result with document type,
-        reasoning, and extracted fields.
+        reasoning, and extracted fields, plus a "cacheable" flag
+        that is False for fallback results.
     """
-    # OCR extraction
-    ocr_text: str = await extract_text_from_image_async(image_path)
-
-    # Image encoding
-    image_base64: str = image_to_base64(image_path)
-
     # Vision LLM request
-    response = client.chat.completions.create(
+    response = await client.chat.completions.create(
         model=VISION_MODEL_NAME,
         temperature=0.1,
         messages=[
@@ -167,7 +285,7 @@ async def classify_image(image_path: str) -> Dict[str, Any]:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{image_base64}"
+                            "url": image_url
                         }
                     }
                 ]
@@ -178,9 +296,11 @@ async def classify_image(image_path: str) -> Dict[str, Any]:
     raw_output: str = response.choices[0].message.content.strip()
 
     # Safe JSON parsing
+    parsed = True
     try:
         result: Dict[str, Any] = extract_json_from_text(raw_output)
     except Exception:
+        parsed = False
         result = {
             "document_type": "unknown",
             "reasoning": "Model output could not be parsed as JSON",
@@ -192,4 +312,89 @@ async def classify_image(image_path: str) -> Dict[str, Any]:
         "document_type": result.get("document_type", "unknown"),
         "reasoning": result.get("reasoning", ""),
         "extracted_textfields": result.get("extracted_textfields", {}),
+        # Fallback results (unparsable output, failed or empty OCR)
+        # may be transient and should not be cached
+        "cacheable": parsed and bool(ocr_text),
     }
+
+
+# --------------------------------------------------
+# ASYNC DOCUMENT CLASSIFICATION
+# --------------------------------------------------
+async def classify_image(
+    image_path: str,
+    image: Optional[Image.Image] = None
+) -> Dict[str, Any]:
+    """
+    Perform document classification using OCR + Vision LLM.
+
+    Steps:
+    1. Extract text using OCR and, concurrently,
+    2. Downscale (if needed) and encode image as a base64 data URL
+    3. Send text + image to Vision LLM
+    4. Parse and normalize JSON output
+
+    Parameters
+    ----------
+    image_path : str
+        Path to the image or PDF page.
+    image : PIL.Image.Image, optional
+        Already opened image for ``image_path``. When omitted the
+        image is opened from disk.
+
+    Returns
+    -------
+    dict
+        Structured classification result with document type,
+        reasoning, and extracted fields.
+    """
+    # OCR extraction and image encoding are independent; run them concurrently
+    if image is None:
+        encode_task = asyncio.to_thread(image_path_to_data_url, image_path)
+    else:
+        encode_task = asyncio.to_thread(image_to_data_url, image)
+
+    ocr_text, image_url = await asyncio.gather(
+        extract_text_from_image_async(image_path),
+        encode_task,
+    )
+
+    return await query_vision_model(ocr_text, image_url)
+
+
+async def classify_image_from_bytes(
+    image_bytes: bytes,
+    file_name: str,
+    image: Optional[Image.Image] = None
+) -> Dict[str, Any]:
+    """
+    Perform document classification on in-memory image bytes.
+
+    OCR and base64 encoding run concurrently from the same buffer,
+    so the image never has to be written to or read from disk.
+
+    Parameters
+    ----------
+    image_bytes : bytes
+        Raw image data.
+    file_name : str
+        Original file name, used to detect the image type for OCR.
+    image : PIL.Image.Image, optional
+        Already opened image for ``image_bytes``. When omitted the
+        image is opened from the bytes.
+
+    Returns
+    -------
+    dict
+        Structured classification result with document type,
+        reasoning, and extracted fields.
+    """
+    if image is None:
+        image = Image.open(io.BytesIO(image_bytes))
+
+    ocr_text, image_url = await asyncio.gather(
+        extract_text_from_bytes_async(image_bytes, file_name),
+        asyncio.to_thread(image_to_data_url, image, image_bytes),
+    )
+
+    return await query_vision_model(ocr_text, image_url)